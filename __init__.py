@@ -9,12 +9,12 @@ def main():
     proj = Project(base_dir)
 
     argv = sys.argv
-    if len(argv) != 2:
+    if len(argv) < 2:
         proj.usage()
         sys.exit(0)
 
     target_name = argv[1]
-    proj.run(target_name)
+    proj.run(target_name, *argv[2:])
 
 
 if __name__ == "__main__":
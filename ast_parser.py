@@ -1,16 +1,50 @@
+import hashlib
+import mmap
 import os
 import re
 
 from core import AstDoc, AstNode
 
+# bump when parsed ast changes for a same source, invalidates compiled code
+VERSION = 2
+
 
 def parse_file(file_path) -> AstDoc:
     name = os.path.splitext(os.path.basename(file_path))[0]
+    return parse(name, source_lines(read_source(file_path)))
 
-    with open(file_path, "r") as fd:
-        lines = [x.rstrip() for x in fd.readlines() if x.strip()]
-        doc = parse(name, lines)
-    return doc
+
+def read_source(file_path) -> bytes:
+    with open(file_path, "rb") as fd:
+        return fd.read()
+
+
+def source_lines(source: bytes):
+    """non-blank lines of source, trailing whitespace stripped"""
+    return [x.rstrip() for x in source.decode("utf-8").splitlines() if x.strip()]
+
+
+def iter_source_lines(file_path):
+    """same as `source_lines`, read lazily through a memory map of the file"""
+    with open(file_path, "rb") as fd:
+        if os.fstat(fd.fileno()).st_size == 0:
+            return
+        with mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for raw in iter(mm.readline, b""):
+                # split further like `str.splitlines`, as on "\r" endings
+                for line in raw.decode("utf-8").splitlines():
+                    if line.strip():
+                        yield line.rstrip()
+
+
+def source_digest(file_path):
+    """sha256 of file content, hashed through a memory map of the file"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as fd:
+        if os.fstat(fd.fileno()).st_size > 0:
+            with mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                digest.update(mm)
+    return digest.hexdigest()
 
 
 def parse(name, lines) -> AstDoc:
@@ -26,27 +60,69 @@ def parse(name, lines) -> AstDoc:
     return doc
 
 
+def is_underline(line):
+    return set(line) == set("=") or set(line) == set("-")
+
+
+def split_sections(lines):
+    """split lines before each h1/h2 header, sections then parse independently"""
+    sections = [[]]
+    for index, line in enumerate(lines):
+        if index + 1 < len(lines) and is_underline(lines[index + 1]):
+            sections.append([])
+        sections[-1].append(line)
+    return [x for x in sections if x]
+
+
+def parse_sections(lines, cached=()):
+    """parse lines section by section, skipping sections in `cached` digests
+
+    Returns [(digest, nodes)], where nodes are None for skipped sections.
+    """
+    result = []
+    for section in split_sections(lines):
+        digest = hashlib.sha256("\n".join(section).encode("utf-8")).hexdigest()
+        nodes = None if digest in cached else parse("", section).children or []
+        result.append((digest, nodes))
+    return result
+
+
+def parse_stream(lines):
+    """yield top level nodes of lines, parsing only a few lines at a time
+
+    Lines are cut before any line that is neither a header underline nor an
+    indented toctree entry, where no node can span the cut, so each chunk
+    parses the same as within the whole document.
+    """
+    chunk = []
+    for line in lines:
+        if chunk and not is_underline(line) and not line[:1].isspace():
+            yield from parse("", chunk).children or []
+            chunk = []
+        chunk.append(line)
+    if chunk:
+        yield from parse("", chunk).children or []
+
+
 def parse_headers(lines):
     index = len(lines) - 1
-    nodes = []
+    nodes = []  # built backwards, then reversed once
     while index >= 0:
         line = lines[index].rstrip()
         if set(line) == set("=") and index > 0:
-            nodes.insert(0, AstNode("h1", lines[index - 1].strip()))
+            nodes.append(AstNode("h1", lines[index - 1].strip()))
             index -= 2
         elif set(line) == set("-") and index > 0:
-            nodes.insert(0, AstNode("h2", lines[index - 1].strip()))
+            nodes.append(AstNode("h2", lines[index - 1].strip()))
             index -= 2
         else:
-            nodes.insert(0, line)
+            nodes.append(line)
             index -= 1
+    nodes.reverse()
     return nodes
 
 
 def parse_toctree(items):
-    def find_index(items, predicate):
-        return next((index for index, x in enumerate(items) if predicate(x)), -1)
-
     def is_toctree_start(x):
         return isinstance(x, str) and x.strip() == ".. toctree::"
 
@@ -55,27 +131,19 @@ def parse_toctree(items):
             isinstance(x, str) and re.search("^([ \t]+)", x) is None
         )
 
-    start = find_index(items, is_toctree_start)
-    if start < 0:
-        for item in items:
-            yield item
-        # yield items  # TODO different from above two lines
-        # return items # TODO why cannot use return
-    else:
-        end = find_index(items[start + 1 :], is_toctree_end)
-        end = start + end + 1 if end >= 0 else len(items)
-
-        for i in range(start):
-            yield items[i]
-
-        toctree = AstNode("toctree")
-        for i in range(start + 1, end):
-            if isinstance(items[i], str) and items[i].strip():
-                toctree.append_child(AstNode("toc", items[i].strip()))
-        yield toctree
-
-        for i in range(end, len(items)):
-            yield items[i]
+    index = 0
+    while index < len(items):
+        if is_toctree_start(items[index]):
+            toctree = AstNode("toctree")
+            index += 1
+            while index < len(items) and not is_toctree_end(items[index]):
+                if items[index].strip():
+                    toctree.append_child(AstNode("toc", items[index].strip()))
+                index += 1
+            yield toctree
+        else:
+            yield items[index]
+            index += 1
 
 
 def parse_paragraphs(items):
@@ -86,9 +154,9 @@ def parse_paragraphs(items):
             p = AstNode("p")
 
             for part in re.split(
-                r"(:doc:`.+`)", item.strip()
+                r"(:doc:`[^`]+`)", item.strip()
             ):  # TODO re.split != str.split and parentheses's function
-                m = re.match(r":doc:`(.+)`", part)
+                m = re.match(r":doc:`([^`]+)`", part)
                 if m:
                     p.append_child(AstNode("a", m.group(1)))
                 else:
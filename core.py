@@ -1,10 +1,31 @@
+import contextlib
+import hashlib
 import os
 import pickle
+import sys
+import time
 import typing
 
+from utils import get_name_prefix
+
+# bump when layout of cached data changes
+CACHE_FORMAT = 4
+# link stamp entry of the level gzip outputs were written at
+GZIP_LEVEL = ("gzip", "level")
+
+
+def cache_version():
+    """version of cache layout and of the code producing cached data"""
+    # imported here, as these modules import this one
+    import ast_parser
+    import transformer
+
+    return (CACHE_FORMAT, ast_parser.VERSION, transformer.VERSION)
+
 
 class BuildContext:
     def __init__(self, base_dir, cache_name=None):
+        self.base_dir = base_dir
         self.src_dir = os.path.join(base_dir, "src")
         self.cache_dir = os.path.join(base_dir, "cache")
         self.build_dir = os.path.join(base_dir, "build")
@@ -13,6 +34,17 @@ class BuildContext:
         self.executed_tasks = []
         self.cache = CacheFile(os.path.join(self.cache_dir, "compile.cache"))
         self.cache_name = cache_name or "compile.cache"
+        self.store = None  # optional SharedCache consulted before compiling
+        self.profiler = None  # optional MemProfiler wrapping each task
+        self.gzip_level = None  # zlib level of gzip output copies, None for none
+        # documents of at least this many lines are compiled section by section
+        self.section_lines = 2000
+        self.streaming = False  # parse and transform sources while reading them
+        self.timings_path = os.path.join(self.cache_dir, "timings.cache")
+        self.timings = {}  # document name -> {step: seconds} measured in this build
+        self.linked = set()  # documents already linked for good in this build
+        self.first_output_at = None  # perf_counter() when first page was linked
+        self.source_digests = {}  # document name -> digest of changed source
 
     def add_compile_task(self, task):
         self.compile_tasks.append(task)
@@ -20,16 +52,130 @@ class BuildContext:
     def add_link_task(self, task):
         self.link_tasks.append(task)
 
-    def execute_task(self, task_list: list, task):
-        task.exec(self)
-        if task_list:
-            task_list.remove(task)
+    def execute_task(self, task):
+        profile = contextlib.nullcontext()
+        if self.profiler is not None:
+            profile = self.profiler.task(task)
+        start = time.perf_counter()
+        with profile:
+            task.exec(self)
+        self.record_timing(task, time.perf_counter() - start)
         self.executed_tasks.append(task)
 
+    def record_timing(self, task, seconds):
+        """add time spent on a document by a compile or link task"""
+        if isinstance(task, Link) and self.first_output_at is None:
+            self.first_output_at = time.perf_counter()
+        name = getattr(task, "name", None)
+        if name is not None:
+            step = "link" if isinstance(task, Link) else "compile"
+            timing = self.timings.setdefault(name, {})
+            timing[step] = timing.get(step, 0) + seconds
+
+    def load_timings(self):
+        """document name -> {step: seconds} recorded by previous builds"""
+        try:
+            with open(self.timings_path, "rb") as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return {}
+
+    def save_timings(self, names=None):
+        """merge timings of this build into saved ones, keep only `names` if given"""
+        timings = self.load_timings()
+        for name, timing in self.timings.items():
+            timings.setdefault(name, {}).update(timing)
+        if names is not None:
+            timings = {k: v for k, v in timings.items() if k in names}
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(self.timings_path, "wb") as f:
+            pickle.dump(timings, f)
+
+    def source_files(self):
+        return sorted(x for x in os.listdir(self.src_dir) if x.endswith(".rst"))
+
+    def dependency_closure(self, names):
+        """names of documents whose code is needed to link `names`"""
+        closure = set(names)
+        for name in names:
+            closure.update(dep for _, dep in self.cache.get_dependencies(name))
+        return closure
+
     def execute_tasks(self, task_list):
         while task_list:
-            for task in task_list[:]:
-                self.execute_task(task_list, task)
+            # tasks added while executing pending ones are run in next round
+            pending = task_list[:]
+            task_list.clear()
+            for task in pending:
+                self.execute_task(task)
+
+    def needs_compile(self, filename):
+        """why source must be compiled again, or None if cached code is current"""
+        name = get_name_prefix(filename)
+        stamp = self.cache.get_source(name)
+        if stamp is None:
+            return "version bump" if self.cache.invalidated else "cache missing"
+        path = os.path.join(self.src_dir, filename)
+        stat = os.stat(path)
+        if stat.st_size != stamp[1]:
+            return "source changed"
+        if stat.st_mtime_ns == stamp[0]:
+            return None
+        from ast_parser import source_digest
+
+        digest = source_digest(path)
+        if digest != stamp[2]:
+            self.source_digests[name] = digest  # not to hash it again on parse
+            return "source changed"
+        # only touched, don't hash it again next time
+        self.cache.set_source(name, (stat.st_mtime_ns, stat.st_size, digest))
+        return None
+
+    def needs_link(self, name):
+        """why document must be linked again, or None if its output is current"""
+        if name in self.linked:
+            return None
+        if not self.has_outputs(name):
+            return "output missing"
+        stamp = self.cache.get_link_stamp(name)
+        if stamp is None:
+            return "never linked"
+        if self.gzip_level is not None and stamp.get(GZIP_LEVEL) != self.gzip_level:
+            return "gzip level changed"
+        for key, digest in sorted(self.link_stamp(name).items()):
+            if stamp.get(key) != digest:
+                return "code changed" if key == ("doc", name) else f"{key} changed"
+        return None
+
+    def link_stamp(self, name):
+        """digests of cached code that document is linked from"""
+        deps = self.cache.get_dependencies(name)
+        return {key: self.cache.get_digest(*key) for key in deps}
+
+    def gzip_reusable(self, name):
+        """whether existing gzip output of document was written at current level"""
+        stamp = self.cache.get_link_stamp(name)
+        return stamp is not None and stamp.get(GZIP_LEVEL) == self.gzip_level
+
+    def record_links(self):
+        """remember what linked documents were linked from, for next builds"""
+        for task in self.executed_tasks:
+            if isinstance(task, Link):
+                stamp = self.link_stamp(task.name)
+                stamp[GZIP_LEVEL] = self.gzip_level
+                self.cache.set_link_stamp(task.name, stamp)
+
+    def output_path(self, name):
+        return os.path.join(self.build_dir, f"{name}.html")
+
+    def has_outputs(self, name):
+        path = self.output_path(name)
+        if self.gzip_level is not None and not os.path.exists(path + ".gz"):
+            return False
+        return os.path.exists(path)
+
+    def shard_path(self, index, count):
+        return os.path.join(self.cache_dir, f"compile.shard-{index}-of-{count}.cache")
 
     def get_title(self, name):
         return self.cache.get_code("title", name)
@@ -48,57 +194,199 @@ class Task:
 
 
 class Scan(Task):
+    """find sources to compile, optionally only the `names` documents
+
+    Sources whose cached code is current are skipped.
+
+    With `shard=(index, count)`, sources are dealt round-robin into `count`
+    slices and only slice `index` is taken, so every node of a distributed
+    build gets a disjoint part of the same sorted source list.
+    """
+
+    def __init__(self, names=None, shard=None):
+        self._names = names
+        self._shard = shard
+
     def __str__(self):
         return "scan"
 
     def run(self):
-        for filename in os.listdir(self.ctx.src_dir):
-            if filename.endswith(".rst"):
-                self.ctx.add_compile_task(Parse(filename))
+        for position, filename in enumerate(self.ctx.source_files()):
+            name = get_name_prefix(filename)
+            if self._names is not None and name not in self._names:
+                continue
+            if self._shard is not None:
+                index, count = self._shard
+                if position % count != index:
+                    continue
+            if self.ctx.needs_compile(filename):
+                digest = self.ctx.source_digests.get(name)
+                self.ctx.add_compile_task(Parse(filename, digest=digest))
+
+
+class ScanLinks(Task):
+    """find documents to link, optionally only the `names` documents
+
+    Documents are skipped when their output exists and neither their code
+    nor code they depend on changed since they were last linked.
+    """
+
+    def __init__(self, names=None):
+        self._names = names
+
+    def __str__(self):
+        return "scan_links"
+
+    def run(self):
+        for filename in self.ctx.source_files():
+            name = get_name_prefix(filename)
+            if self._names is not None and name not in self._names:
+                continue
+            if self.ctx.needs_link(name):
                 self.ctx.add_link_task(Link(filename))
 
 
+class ScanDependencies(Task):
+    """compile the documents that `names` depend on, without linking them"""
+
+    def __init__(self, names):
+        self._names = names
+
+    def __str__(self):
+        return f"scan_dependencies({', '.join(self._names)})"
+
+    def run(self):
+        closure = self.ctx.dependency_closure(self._names)
+        for filename in self.ctx.source_files():
+            name = get_name_prefix(filename)
+            if name in closure and name not in self._names:
+                if self.ctx.needs_compile(filename):
+                    digest = self.ctx.source_digests.get(name)
+                    self.ctx.add_compile_task(Parse(filename, digest=digest))
+
+
 class Parse(Task):
     """rst file -> ast model"""
 
-    def __init__(self, filename):
+    def __init__(self, filename, source=None, digest=None):
         self._filename = filename
+        self.name = get_name_prefix(filename)
+        self.source = source  # file content, read on run if not prefetched
+        self.digest = digest  # digest of file content, if hashed while scanning
 
     def __str__(self):
         return f"parse({self._filename})"
 
+    def source_path(self, ctx: BuildContext):
+        return os.path.join(ctx.src_dir, self._filename)
+
     def run(self):
-        self.ctx.add_compile_task(Transform(self._filename))
+        from ast_parser import parse, parse_sections, read_source, source_lines
+
+        path = self.source_path(self.ctx)
+        if self.ctx.streaming and self.source is None:
+            self.run_streaming(path)
+            return
+        if self.source is None:
+            self.source = read_source(path)
+        name = self.name
+        stat = os.stat(path)
+        digest = self.digest or hashlib.sha256(self.source).hexdigest()
+        self.ctx.cache.set_source(name, (stat.st_mtime_ns, stat.st_size, digest))
+
+        key = None
+        if self.ctx.store is not None:
+            key = self.ctx.store.key(name, self.source)
+            code = self.ctx.store.get(key)
+            if code is not None:
+                self.source = None
+                self.ctx.add_compile_task(WriteCache(code))
+                return
+
+        lines = source_lines(self.source)
+        self.source = None
+        if len(lines) >= self.ctx.section_lines:
+            cached = dict(self.ctx.cache.get_sections(name))
+            sections = parse_sections(lines, cached)
+            self.ctx.add_compile_task(TransformSections(name, sections, key))
+        else:
+            self.ctx.add_compile_task(Transform(parse(name, lines), key))
+
+    def run_streaming(self, path):
+        """parse and transform together, never holding whole source or ast
+
+        Only headers are kept until the end, for title and toctree. The shared
+        store is not used, as its key needs the whole source.
+        """
+        from ast_parser import iter_source_lines, parse_stream, source_digest
+        from transformer import transform_stream
+
+        stat = os.stat(path)
+        stamp = (stat.st_mtime_ns, stat.st_size, self.digest or source_digest(path))
+        self.ctx.cache.set_source(self.name, stamp)
+        nodes = parse_stream(iter_source_lines(path))
+        self.ctx.add_compile_task(WriteCache(transform_stream(self.name, nodes)))
 
 
 class Transform(Task):
     """ast model -> code model"""
 
-    def __init__(self, filename):
-        self._filename = filename
+    def __init__(self, ast, key=None):
+        self.ast = ast
+        self.name = ast.data
+        self.key = key
 
     def __str__(self):
-        return f"transform({self._filename})"
+        return f"transform({self.ast.data})"
 
     def run(self):
-        self.ctx.add_compile_task(WriteCache(self._filename))
+        from transformer import transform
+
+        self.ctx.add_compile_task(WriteCache(transform(self.ast), self.key))
+
+
+class TransformSections(Task):
+    """ast of changed sections -> code model, reusing code of other sections"""
+
+    def __init__(self, name, sections, key=None):
+        self.name = name
+        self.sections = sections  # [(digest, nodes or None if unchanged)]
+        self.key = key
+
+    def __str__(self):
+        return f"transform_sections({self.name})"
+
+    def run(self):
+        from transformer import assemble_sections, transform_section
+
+        cached = dict(self.ctx.cache.get_sections(self.name))
+        sections = []
+        for digest, nodes in self.sections:
+            section = cached[digest] if nodes is None else transform_section(nodes)
+            sections.append((digest, section))
+        self.ctx.cache.set_sections(self.name, sections)
+        code = assemble_sections(self.name, [x for _, x in sections])
+        self.ctx.add_compile_task(WriteCache(code, self.key))
 
 
 class WriteCache(Task):
-    """write code to cache"""
+    """write code to cache, which is saved once compiling is done
+
+    With a `key`, code is also put in the shared store under that key.
+    """
 
-    def __init__(self, code):
+    def __init__(self, code, key=None):
         self.code = code
+        self.name = code.name
+        self.key = key
 
     def __str__(self):
         return f"write_tpl({self.code.name})"
 
     def run(self):
-        self.ctx.cache.set_output(self.code.name, self.code.dependencies)
-        self.ctx.cache.set_input("doc", self.code.name, self.code.html)
-        self.ctx.cache.set_input("title", self.code.name, self.code.title)
-        self.ctx.cache.set_input("toctree", self.code.name, self.code.toctree)
-        self.ctx.cache.save()
+        self.code.write_cache(self.ctx.cache)
+        if self.key is not None:
+            self.ctx.store.put(self.key, self.code)
 
 
 class Link(Task):
@@ -106,19 +394,27 @@ class Link(Task):
 
     def __init__(self, filename):
         self._filename = filename
+        self.name = get_name_prefix(filename)
 
     def __str__(self):
         return f"link({self._filename})"
 
     def run(self):
-        import pprint
+        from linker import write_output
 
-        pprint.pprint(self.ctx.cache._data)
+        reuse_gzip = self.ctx.gzip_reusable(self.name)
+        write_output(*self.render(), self.ctx.gzip_level, reuse_gzip)
+
+    def render(self):
+        """output path and html lines of the document"""
+        from linker import link
+
+        return self.ctx.output_path(self.name), list(link(self.ctx, self.name))
 
 
 class AstNode:
     def __init__(self, name, data=None):
-        self.name = name
+        self.name = sys.intern(name)  # node kind, interned for dispatch
         self.data = data
         self.children = None
 
@@ -190,29 +486,68 @@ class Code:
     def add_dependency(self, kind, name):
         self.dependencies.add((kind, name))
 
+    def entries(self):
+        """cached code by kind"""
+        return {"doc": self.html, "title": self.title, "toctree": self.toctree}
+
     def write_cache(self, cache):
         cache.set_dependencies(self.name, self.dependencies)
-        cache.set_code("doc", self.name, self.html)
-        cache.set_code("title", self.name, self.title)
-        cache.set_code("toctree", self.name, self.toctree)
+        for kind, value in self.entries().items():
+            cache.set_code(kind, self.name, value)
 
 
 class CacheFile:
     def __init__(self, path):
         self.path = path
-        self._data = {"dependencies": {}, "code": {}}
+        self.readonly = False
+        self.invalidated = False  # whether an outdated cache file was dropped
+        self._data = self.empty()
         if os.path.exists(path):
             self.load()
 
+    @staticmethod
+    def empty():
+        return {
+            "version": cache_version(),
+            "sources": {},  # name -> (mtime_ns, size, sha256) of compiled source
+            "dependencies": {},
+            "code": {},
+            "digests": {},  # (kind, name) -> sha256 of pickled code
+            # name -> {(kind, name): digest} of code the document was linked from
+            "links": {},
+            # name -> [(digest, (headers, html, dependencies))] of large documents
+            "sections": {},
+        }
+
+    @contextlib.contextmanager
+    def frozen(self):
+        """Forbid changes, so that the cache can be shared with other processes"""
+        self.readonly = True
+        try:
+            yield self
+        finally:
+            self.readonly = False
+
+    def check_writable(self):
+        if self.readonly:
+            raise ValueError(f"Cache is frozen: {self.path}")
+
     def purge(self):
         if os.path.exists(self.path):
             os.unlink(self.path)
-        self._data = {"dependencies": {}, "code": {}}
+        self._data = self.empty()
 
     def load(self):
-        """Load from file"""
-        with open(self.path, "rb") as f:
-            self._data = pickle.load(f)
+        """Load from file, dropping its content if written by another version"""
+        try:
+            with open(self.path, "rb") as f:
+                data = pickle.load(f)
+        except (EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            data = None
+        if not isinstance(data, dict) or data.get("version") != cache_version():
+            self.invalidated = True
+            data = self.empty()
+        self._data = data
 
     def save(self):
         """Save to file"""
@@ -220,15 +555,78 @@ class CacheFile:
         with open(self.path, "wb") as f:
             pickle.dump(self._data, f)
 
+    def merge(self, other: "CacheFile"):
+        """Add entries of other cache, which must not disagree with ours"""
+        for section, entries in other._data.items():
+            if section == "version":
+                continue
+            mine = self._data[section]
+            for key, value in entries.items():
+                if key in mine and mine[key] != value:
+                    raise ValueError(f"Conflicting cache key: {section} {key}")
+                mine[key] = value
+
+    def entry_sizes(self):
+        """pickled size of each code entry, keyed by (kind, name)"""
+        return {key: len(pickle.dumps(x)) for key, x in self._data["code"].items()}
+
+    def names(self):
+        """names of documents in the cache"""
+        return set(self._data["dependencies"])
+
+    def collect(self, names):
+        """Remove entries of documents other than `names`, return their count"""
+        self.check_writable()
+        removed = 0
+        for name in self.names() - set(names):
+            del self._data["dependencies"][name]
+            self._data["sources"].pop(name, None)
+            self._data["sections"].pop(name, None)
+            self._data["links"].pop(name, None)
+            removed += 1
+        code = self._data["code"]
+        for key in [x for x in code if x[1] not in names]:
+            del code[key]
+            self._data["digests"].pop(key, None)
+            removed += 1
+        return removed
+
     def set_dependencies(self, name, value):
+        self.check_writable()
         self._data["dependencies"][name] = value
 
     def get_dependencies(self, name):
         return self._data["dependencies"][name]
 
+    def set_source(self, name, stamp):
+        self.check_writable()
+        self._data["sources"][name] = stamp
+
+    def get_source(self, name):
+        return self._data["sources"].get(name)
+
+    def set_sections(self, name, sections):
+        self.check_writable()
+        self._data["sections"][name] = sections
+
+    def get_sections(self, name):
+        return self._data["sections"].get(name, [])
+
+    def set_link_stamp(self, name, stamp):
+        self.check_writable()
+        self._data["links"][name] = stamp
+
+    def get_link_stamp(self, name):
+        return self._data["links"].get(name)
+
     def set_code(self, kind, name, data):
+        self.check_writable()
         key = (kind, name)
         self._data["code"][key] = data
+        self._data["digests"][key] = hashlib.sha256(pickle.dumps(data)).hexdigest()
+
+    def get_digest(self, kind, name):
+        return self._data["digests"].get((kind, name))
 
     def get_code(self, kind, name):
         key = (kind, name)
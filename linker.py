@@ -1,5 +1,15 @@
+import gzip
+import hashlib
+import multiprocessing
+import os
+import time
 from typing import Iterable
 
+from core import BuildContext, CacheFile
+
+# build context of link worker processes
+_worker_ctx = None
+
 
 def link(ctx, name):
     """process link step to generate final html lines"""
@@ -22,3 +32,75 @@ def get_output_lines(ctx, line):
             raise ValueError(f"Expected either str of list[str]", result)
     else:
         yield line
+
+
+def write_output(path, lines, gzip_level=None, reuse_gzip=False):
+    """write html lines into output file, and a gzip copy next to it if asked
+
+    `reuse_gzip` tells that the existing gzip copy was written at the same
+    level; it is then kept when the html is the same as in previous build,
+    instead of compressing it again.
+    """
+    data = "".join(line + "\n" for line in lines).encode("utf-8")
+    gzip_path = path + ".gz"
+    if gzip_level is not None and reuse_gzip and os.path.exists(gzip_path):
+        if file_digest(path) == hashlib.sha256(data).hexdigest():
+            return
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+    if gzip_level is not None:
+        with open(gzip_path, "wb") as f:
+            f.write(gzip.compress(data, gzip_level, mtime=0))
+
+
+def file_digest(path):
+    """sha256 of file content, or None if it does not exist"""
+    try:
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+def execute_link_tasks(ctx: BuildContext, task_list, jobs):
+    """Execute `Link` tasks in `jobs` worker processes
+
+    The cache is frozen while linking. Forked workers inherit it from the
+    parent instead of each receiving a pickled copy; where fork is not
+    available, each worker loads the saved cache file once. Workers write
+    their output files themselves.
+    """
+    global _worker_ctx
+
+    tasks = task_list[:]
+    task_list.clear()
+    methods = multiprocessing.get_all_start_methods()
+    mp_ctx = multiprocessing.get_context("fork" if "fork" in methods else None)
+    with ctx.cache.frozen():
+        _worker_ctx = ctx if mp_ctx.get_start_method() == "fork" else None
+        try:
+            init_args = (ctx.base_dir, ctx.cache.path, ctx.gzip_level)
+            with mp_ctx.Pool(jobs, _init_worker, init_args) as pool:
+                seconds = pool.map(_execute_link_task, tasks)
+        finally:
+            _worker_ctx = None
+    for task, elapsed in zip(tasks, seconds):
+        ctx.record_timing(task, elapsed)
+    ctx.executed_tasks.extend(tasks)
+
+
+def _init_worker(base_dir, cache_path, gzip_level):
+    global _worker_ctx
+
+    if _worker_ctx is None:
+        _worker_ctx = BuildContext(base_dir)
+        _worker_ctx.cache = CacheFile(cache_path)
+        _worker_ctx.gzip_level = gzip_level
+
+
+def _execute_link_task(task):
+    start = time.perf_counter()
+    task.exec(_worker_ctx)
+    return time.perf_counter() - start
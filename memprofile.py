@@ -0,0 +1,88 @@
+import contextlib
+import tracemalloc
+
+MiB = 2**20
+
+
+class MemoryBudgetExceeded(Exception):
+    pass
+
+
+class MemProfiler:
+    """Trace peak memory and top allocation sites of build phases
+
+    With `per_task`, peak memory is also recorded for each kind of task.
+    Exceeding `budget` bytes in a phase or task fails the build.
+    """
+
+    def __init__(self, budget=None, per_task=False, top=5):
+        self.budget = budget
+        self.per_task = per_task
+        self.top = top
+        self.phases = []  # (name, peak, top allocation stats)
+        self.task_peaks = {}  # task kind -> peak
+        self._phase_peak = 0
+
+    def start(self):
+        tracemalloc.start()
+
+    def stop(self):
+        tracemalloc.stop()
+
+    def snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__)]
+        )
+
+    def _peak(self):
+        """peak since last reset, which then starts again from current size"""
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        return peak
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        self._peak()
+        self._phase_peak = 0
+        before = self.snapshot()
+        yield
+        peak = max(self._phase_peak, self._peak())
+        stats = self.snapshot().compare_to(before, "lineno")[: self.top]
+        self.phases.append((name, peak, stats))
+        self.check(name, peak)
+
+    @contextlib.contextmanager
+    def task(self, task):
+        self._phase_peak = max(self._phase_peak, self._peak())
+        yield
+        peak = self._peak()
+        self._phase_peak = max(self._phase_peak, peak)
+        kind = type(task).__name__.lower()
+        self.task_peaks[kind] = max(self.task_peaks.get(kind, 0), peak)
+        self.check(str(task), peak)
+
+    def check(self, name, peak):
+        if self.budget is not None and peak > self.budget:
+            raise MemoryBudgetExceeded(
+                f"{name} peaked at {peak / MiB:.1f} MiB, "
+                f"over budget of {self.budget / MiB:.1f} MiB"
+            )
+
+    def report(self, cache):
+        print("Memory profile:")
+        for name, peak, stats in self.phases:
+            print(f"  {name}: peak {peak / MiB:.2f} MiB")
+            for stat in stats:
+                frame = stat.traceback[0]
+                print(
+                    f"    {frame.filename}:{frame.lineno}: "
+                    f"{stat.size_diff / 1024:+.1f} KiB"
+                )
+        for kind, peak in sorted(self.task_peaks.items()):
+            print(f"  task {kind}: peak {peak / MiB:.2f} MiB")
+
+        sizes = cache.entry_sizes()
+        largest = sorted(sizes.items(), key=lambda x: x[1], reverse=True)
+        print("  largest cache entries:")
+        for (kind, name), size in largest[: self.top]:
+            print(f"    {kind} {name}: {size / 1024:.1f} KiB")
@@ -0,0 +1,80 @@
+import asyncio
+import time
+from collections import deque
+
+from ast_parser import read_source
+from core import BuildContext, Link, Parse
+from linker import write_output
+
+
+def execute_tasks(ctx: BuildContext, task_list, prefetch=8, writers=4):
+    """Same as `ctx.execute_tasks`, but overlap file I/O with CPU work
+
+    Sources of `Parse` tasks are read ahead by up to `prefetch` threads, and
+    output of `Link` tasks is written, and gzip compressed if asked, by
+    `writers` tasks through a bounded queue, so rendering waits when writers
+    fall behind.
+    """
+    asyncio.run(_execute_tasks(ctx, task_list, prefetch, writers))
+
+
+async def _execute_tasks(ctx: BuildContext, task_list, prefetch, writers):
+    outputs = asyncio.Queue(maxsize=writers)
+    errors = []
+    write_workers = [
+        asyncio.create_task(_write(outputs, errors, ctx.gzip_level))
+        for _ in range(writers)
+    ]
+    try:
+        while task_list:
+            pending = task_list[:]
+            task_list.clear()
+            await _execute_pending(ctx, pending, prefetch, outputs)
+        await outputs.join()
+        if errors:
+            raise errors[0]
+    finally:
+        for worker in write_workers:
+            worker.cancel()
+
+
+async def _execute_pending(ctx: BuildContext, pending, prefetch, outputs):
+    # streaming parse reads sources itself, bit by bit
+    prefetched = [x for x in pending if isinstance(x, Parse) and not ctx.streaming]
+    parse_tasks = iter(prefetched)
+    reads = deque()
+
+    def read_ahead():
+        while len(reads) < prefetch:
+            task = next(parse_tasks, None)
+            if task is None:
+                break
+            path = task.source_path(ctx)
+            reads.append(asyncio.create_task(asyncio.to_thread(read_source, path)))
+
+    for task in pending:
+        if isinstance(task, Parse) and not ctx.streaming:
+            read_ahead()
+            task.source = await reads.popleft()
+        if isinstance(task, Link):
+            task.ctx = ctx
+            start = time.perf_counter()
+            path, lines = task.render()
+            ctx.record_timing(task, time.perf_counter() - start)
+            await outputs.put((path, lines, ctx.gzip_reusable(task.name)))
+            ctx.executed_tasks.append(task)
+        else:
+            ctx.execute_task(task)
+        # let reader and writer threads get scheduled between CPU-bound tasks
+        await asyncio.sleep(0)
+
+
+async def _write(outputs: asyncio.Queue, errors, gzip_level):
+    while True:
+        path, lines, reuse_gzip = await outputs.get()
+        try:
+            await asyncio.to_thread(write_output, path, lines, gzip_level, reuse_gzip)
+        except Exception as e:  # keep writing, so that queue never stalls
+            errors.append(e)
+        finally:
+            outputs.task_done()
@@ -1,8 +1,21 @@
+import contextlib
+import glob
 import os
+import re
 import shutil
 import sys
+import time
+import zlib
 
-from core import BuildContext, Scan
+import pipeline
+from core import BuildContext, CacheFile, Link, Scan, ScanDependencies, ScanLinks
+from linker import execute_link_tasks
+from memprofile import MiB, MemProfiler
+from store import SharedCache
+from utils import get_name_prefix, parse_option, parse_shard
+
+# how many of the most recently changed documents are built first
+RECENT_PRIORITIES = 3
 
 
 class Project:
@@ -10,38 +23,312 @@ class Project:
 
     def __init__(self, base_dir):
         self.ctx = BuildContext(base_dir)
-        self.targets = ("build", "clean", "rebuild")
+        self.targets = (
+            "build",
+            "clean",
+            "rebuild",
+            "compile",
+            "merge",
+            "gc",
+            "cache-stats",
+            "plan",
+        )
+        self.options = {}
+        self.profiler = None
+        self.time_to_first_page = None
 
     def usage(self):
         entry = os.path.basename(sys.argv[0])
         print("Usage:")
         for target in self.targets:
-            method = getattr(self, target)
-            print(f"{entry} {method.__name__} - {method.__doc__}")
+            method = getattr(self, target.replace("-", "_"))
+            print(f"{entry} {target} - {method.__doc__}")
 
-    def run(self, target_name):
-        """Run specified target"""
+    def run(self, target_name, *args):
+        """Run specified target, `--name[=value]` arguments are options"""
         assert target_name in self.targets, f"Unsupported target: {target_name}"
-        method = getattr(self, target_name)
-        method()
+        method = getattr(self, target_name.replace("-", "_"))
+        self.options = dict(parse_option(x) for x in args if x.startswith("--"))
+        if "shared-cache" in self.options:
+            max_bytes = int(self.options.get("shared-cache-size", 1024)) * 2**20
+            self.ctx.store = SharedCache(self.options["shared-cache"], max_bytes)
+        self.ctx.streaming = bool(self.options.get("stream"))
+        if "gzip" in self.options:
+            level = self.options["gzip"]
+            if level is True:
+                level = zlib.Z_DEFAULT_COMPRESSION
+            level = int(level)
+            assert -1 <= level <= 9, f"Invalid gzip level: {level}"
+            self.ctx.gzip_level = level
+        if "memprofile" in self.options or "memory-budget" in self.options:
+            self.start_profiler()
+
+        try:
+            method(*[x for x in args if not x.startswith("--")])
+        finally:
+            if self.profiler is not None:
+                self.profiler.stop()
+                self.profiler.report(self.ctx.cache)
+
+    def start_profiler(self):
+        """--memprofile[=tasks] and --memory-budget=MB options"""
+        budget = self.options.get("memory-budget")
+        per_task = self.options.get("memprofile") == "tasks"
+        self.profiler = MemProfiler(budget and int(budget) * MiB, per_task)
+        self.ctx.profiler = self.profiler if per_task else None
+        self.profiler.start()
+
+    def phase(self, name):
+        if self.profiler is None:
+            return contextlib.nullcontext()
+        return self.profiler.phase(name)
+
+    def execute_compile_tasks(self):
+        self.execute_tasks(self.ctx.compile_tasks)
 
-    def build(self):
-        """Build project"""
+    def evict_store(self):
+        """trim shared compile store once compiling is done"""
+        if self.ctx.store is not None:
+            self.ctx.store.evict()
+
+    def execute_link_tasks(self):
+        # compress on worker processes, unless those of --async writers
+        default_jobs = 1
+        if self.ctx.gzip_level is not None and not self.options.get("async"):
+            default_jobs = os.cpu_count() or 1
+        jobs = int(self.options.get("jobs", default_jobs))
+        # a single page, like a priority one, gains nothing from worker processes
+        parallel = jobs > 1 and len(self.ctx.link_tasks) > 1
+        # memory of worker processes is out of sight of the profiler
+        if parallel and self.profiler is None:
+            execute_link_tasks(self.ctx, self.ctx.link_tasks, jobs)
+        else:
+            self.execute_tasks(self.ctx.link_tasks)
+
+    def execute_tasks(self, task_list):
+        if self.options.get("async"):
+            prefetch = int(self.options.get("prefetch", 8))
+            writers = int(self.options.get("writers", 4))
+            pipeline.execute_tasks(self.ctx, task_list, prefetch, writers)
+        else:
+            self.ctx.execute_tasks(task_list)
+
+    def build(self, *names):
+        """Build project, or only the given documents and what they depend on"""
         """
         1. get all tasks
         2. execute_all_tasks()
         """
-        self.ctx.execute_task(None, Scan())
-        self.ctx.execute_tasks(self.ctx.compile_tasks)
-        self.ctx.execute_tasks(self.ctx.link_tasks)
+        start = time.perf_counter()
+        sources = {get_name_prefix(x) for x in self.ctx.source_files()}
+        for name in names:
+            assert name in sources, f"Unknown document: {name}"
+
+        with self.phase("scan"):
+            self.ctx.execute_task(Scan(names or None))
+        with self.phase("compile"):
+            if not names:
+                for name in self.priorities():
+                    self.build_first(name)
+            self.execute_compile_tasks()
+            if names:
+                self.ctx.execute_task(ScanDependencies(names))
+                self.execute_compile_tasks()
+            self.evict_store()
+        with self.phase("write-cache"):
+            self.ctx.cache.save()
+        try:
+            with self.phase("link"):
+                self.ctx.execute_task(ScanLinks(names or None))
+                self.execute_link_tasks()
+        finally:
+            # also after a failed link, so linked pages are not linked again
+            self.ctx.record_links()
+            self.ctx.cache.save()
+        self.ctx.save_timings()
+        if self.ctx.first_output_at is not None:
+            self.time_to_first_page = self.ctx.first_output_at - start
+            print(f"Time to first page: {self.time_to_first_page:.3f}s")
+
+    def priorities(self):
+        """documents to build before the rest of the site, in order
+
+        These are the --first=name,... documents, index, and the documents
+        whose sources changed most recently.
+        """
+        sources = {get_name_prefix(x): x for x in self.ctx.source_files()}
+        first = [x for x in str(self.options.get("first", "")).split(",") if x]
+        for name in first:
+            assert name in sources, f"Unknown document: {name}"
+
+        def modified(name):
+            return os.stat(os.path.join(self.ctx.src_dir, sources[name])).st_mtime_ns
+
+        changed = sorted({x.name for x in self.ctx.compile_tasks}, key=modified)
+        result = []
+        for name in first + ["index"] + changed[::-1][:RECENT_PRIORITIES]:
+            if name in sources and name not in result:
+                result.append(name)
+        return result
+
+    def build_first(self, name):
+        """compile what document needs, then link it before anything else"""
+        pending = self.ctx.compile_tasks[:]
+        self.ctx.compile_tasks.clear()
+        pending = self.execute_compile_tasks_of(pending, {name})
+        closure = self.ctx.dependency_closure([name])
+        pending = self.execute_compile_tasks_of(pending, closure)
+        self.ctx.compile_tasks.extend(pending)
+
+        self.ctx.execute_task(ScanLinks([name]))
+        self.execute_link_tasks()
+        self.ctx.linked.add(name)
+
+    def execute_compile_tasks_of(self, pending, names):
+        """execute pending compile tasks of `names` documents, return the rest"""
+        self.ctx.compile_tasks.extend(x for x in pending if x.name in names)
+        self.execute_compile_tasks()
+        return [x for x in pending if x.name not in names]
 
     def clean(self):
         """Clean intermediate file"""
-        shutil.rmtree(self.build_dir, ignore_errors=True)
-        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        shutil.rmtree(self.ctx.build_dir, ignore_errors=True)
+        shutil.rmtree(self.ctx.cache_dir, ignore_errors=True)
+        self.ctx.cache.purge()
         print("Cleaned up.")
 
     def rebuild(self):
         "Force rebuild"
         self.clean()
         self.build()
+
+    def compile(self):
+        """Compile a slice of sources into a cache shard, --shard=i/N"""
+        index, count = parse_shard(self.options.get("shard", "0/1"))
+        self.ctx.cache = CacheFile(self.ctx.shard_path(index, count))
+        self.ctx.cache.purge()
+        self.ctx.execute_task(Scan(shard=(index, count)))
+        self.execute_compile_tasks()
+        self.evict_store()
+        self.ctx.cache.save()
+        print(f"Compiled shard {index}/{count} into {self.ctx.cache.path}")
+
+    def merge(self, *paths):
+        """Merge cache shards (default: latest compiled ones in cache dir) and link"""
+        paths = paths or self.latest_shards()
+        self.ctx.cache.purge()
+        for path in paths:
+            self.ctx.cache.merge(CacheFile(path))
+
+        sources = self.ctx.source_files()
+        missing = {get_name_prefix(x) for x in sources} - self.ctx.cache.names()
+        assert not missing, f"Documents missing from shards: {sorted(missing)}"
+        self.ctx.cache.save()
+
+        for filename in sources:
+            self.ctx.add_link_task(Link(filename))
+        try:
+            self.execute_link_tasks()
+        finally:
+            self.ctx.record_links()
+            self.ctx.cache.save()
+
+    def latest_shards(self):
+        """all N shards of the count most recently compiled with, --shard=i/N
+
+        Shards left by earlier runs with another count are ignored.
+        """
+        shards = glob.glob(self.ctx.shard_path("*", "*"))
+        assert shards, "No cache shards to merge"
+        latest = os.path.basename(max(shards, key=os.path.getmtime))
+        count = int(re.fullmatch(r"compile\.shard-\d+-of-(\d+)\.cache", latest)[1])
+        paths = [self.ctx.shard_path(index, count) for index in range(count)]
+        missing = [x for x in paths if not os.path.exists(x)]
+        assert not missing, f"Missing cache shards: {missing}"
+        return paths
+
+    def gc(self):
+        """Drop cache entries of deleted documents and compact the cache"""
+        cache = self.ctx.cache
+        size = os.path.getsize(cache.path) if os.path.exists(cache.path) else 0
+        names = {get_name_prefix(x) for x in self.ctx.source_files()}
+        removed = cache.collect(names)
+        cache.save()
+        self.ctx.save_timings(names)
+        print(
+            f"Removed {removed} cache entries, "
+            f"{size} -> {os.path.getsize(cache.path)} bytes."
+        )
+
+    def cache_stats(self):
+        """Report cache entry counts and sizes"""
+        cache = self.ctx.cache
+        size = os.path.getsize(cache.path) if os.path.exists(cache.path) else 0
+        print(f"{cache.path}: {size} bytes, {len(cache.names())} documents")
+
+        kinds = {}
+        documents = {}
+        for (kind, name), entry_size in cache.entry_sizes().items():
+            count, total = kinds.get(kind, (0, 0))
+            kinds[kind] = (count + 1, total + entry_size)
+            documents[name] = documents.get(name, 0) + entry_size
+        for kind, (count, total) in sorted(kinds.items()):
+            print(f"  {kind}: {count} entries, {total} bytes")
+
+        largest = sorted(documents.items(), key=lambda x: x[1], reverse=True)
+        print("Largest documents:")
+        for name, total in largest[:10]:
+            print(f"  {name}: {total} bytes")
+
+    def plan(self, *names):
+        """Show what building would compile and link and why, without doing it"""
+        ctx = self.ctx
+        sources = {get_name_prefix(x): x for x in ctx.source_files()}
+        for name in names:
+            assert name in sources, f"Unknown document: {name}"
+        selected = names or sorted(sources)
+
+        needed = set(selected)
+        for name in selected:
+            if ctx.cache.get_source(name) is not None:
+                needed |= ctx.dependency_closure([name])
+        compiles = {}
+        for name in sorted(needed & set(sources)):
+            reason = ctx.needs_compile(sources[name])
+            if reason:
+                compiles[name] = reason
+
+        timings = ctx.load_timings()
+        total = 0
+        unknown = 0
+        for name in sorted(needed & set(sources)):
+            steps = []
+            if name in compiles:
+                steps.append(("compile", compiles[name]))
+            if name in selected:
+                reason = self.plan_link(name, compiles)
+                if reason:
+                    steps.append(("link", reason))
+            if not steps:
+                print(f"{name}: skip")
+                continue
+
+            costs = [timings.get(name, {}).get(step) for step, _ in steps]
+            if None in costs:
+                unknown += 1
+                cost = "?"
+            else:
+                total += sum(costs)
+                cost = f"{sum(costs):.3f}s"
+            reasons = "; ".join(f"{step}: {reason}" for step, reason in steps)
+            print(f"{name}: {reasons} ~{cost}")
+        print(f"Estimated cost: {total:.3f}s, {unknown} documents without timings")
+
+    def plan_link(self, name, compiles):
+        """why document would be linked after compiling `compiles`, or None"""
+        if name in compiles:
+            return compiles[name]
+        for key in sorted(self.ctx.cache.get_dependencies(name)):
+            if key[1] in compiles:
+                return f"dependency {key} changed"
+        return self.ctx.needs_link(name)
@@ -0,0 +1,87 @@
+import contextlib
+import hashlib
+import os
+import pickle
+import tempfile
+import time
+
+from core import Code, cache_version
+
+# temp files older than this are left over by crashed builds, not being written
+STALE_TMP_SECONDS = 24 * 60 * 60
+
+
+class SharedCache:
+    """Content addressed store of compiled code, shareable between checkouts
+
+    Entries are keyed by document name, source bytes and parser/transformer
+    versions, so any build of the same source reuses them. Entries are
+    written to a temp file then renamed, so concurrent builds only ever see
+    whole entries, and a vanished or unreadable entry is just a miss.
+    """
+
+    def __init__(self, root, max_bytes=2**30):
+        self.root = root
+        self.max_bytes = max_bytes
+
+    def key(self, name, source: bytes) -> str:
+        digest = hashlib.sha256(f"{cache_version()}\0{name}\0".encode("utf-8"))
+        digest.update(source)
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], key[2:])
+
+    def get(self, key) -> Code:
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                code = pickle.load(f)
+            os.utime(path)  # mtime tracks last use for eviction
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        return code
+
+    def put(self, key, code: Code):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(code, f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(tmp_path)
+            raise
+
+    def evict(self):
+        """Remove least recently used entries until store fits in max_bytes
+
+        Temp files of entries being written by other builds are left alone,
+        only stale ones are removed.
+        """
+        entries = []
+        stale = time.time() - STALE_TMP_SECONDS
+        for dir_path, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(dir_path, filename)
+                try:
+                    stat = os.stat(path)
+                    if filename.endswith(".tmp"):
+                        if stat.st_mtime < stale:
+                            os.unlink(path)
+                        continue
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
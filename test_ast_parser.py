@@ -1,15 +1,27 @@
 import os
+import tempfile
 from unittest import TestCase
 
-from ast_parser import parse_file
+from ast_parser import (
+    iter_source_lines,
+    parse,
+    parse_file,
+    parse_stream,
+    read_source,
+    source_lines,
+    split_sections,
+)
 from core import AstDoc
 
 
-def parse_ast(file_name: str) -> AstDoc:
-    file_path = os.path.normpath(
+def source_path(file_name: str) -> str:
+    return os.path.normpath(
         os.path.join(os.path.dirname(__file__), f"./sphinx-example/source/{file_name}")
     )
-    return parse_file(file_path)
+
+
+def parse_ast(file_name: str) -> AstDoc:
+    return parse_file(source_path(file_name))
 
 
 class ParserTest(TestCase):
@@ -70,3 +82,51 @@ doc(index)
     text(This is the main text.)
         """,
         )
+
+    def test_parse_toctrees(self):
+        lines = [".. toctree::", "   install", "Text", ".. toctree::", "   api"]
+        self.assertEqual(
+            """
+doc(index)
+  toctree
+    toc(install)
+  p
+    text(Text)
+  toctree
+    toc(api)
+            """.strip(),
+            parse("index", lines).dump_ast(),
+        )
+
+    def test_split_sections(self):
+        lines = ["Intro", "Title", "=====", "Text", "Sub", "---", "More"]
+        self.assertEqual(
+            [["Intro"], ["Title", "=====", "Text"], ["Sub", "---", "More"]],
+            split_sections(lines),
+        )
+
+    def test_parse_stream(self):
+        for file_name in ("api.rst", "index.rst", "install.rst", "tutorial.rst"):
+            path = source_path(file_name)
+            lines = list(iter_source_lines(path))
+            self.assertEqual(source_lines(read_source(path)), lines)
+            doc = AstDoc("doc")
+            for node in parse_stream(iter(lines)):
+                doc.append_child(node)
+            self.assertEqual(parse("doc", lines).dump_ast(), doc.dump_ast())
+
+    def test_iter_source_lines_endings(self):
+        source = b"Title\r=====\r\rText\r\nmore \n\x0cend"
+        with tempfile.NamedTemporaryFile(suffix=".rst", delete=False) as f:
+            f.write(source)
+        self.addCleanup(os.unlink, f.name)
+        lines = list(iter_source_lines(f.name))
+        self.assertEqual(["Title", "=====", "Text", "more", "end"], lines)
+        self.assertEqual(source_lines(source), lines)
+
+    def test_parse_stream_underlines(self):
+        lines = ["A", "===", "===", ".. toctree::", "   b", "   ---", "c"]
+        doc = AstDoc("doc")
+        for node in parse_stream(iter(lines)):
+            doc.append_child(node)
+        self.assertEqual(parse("doc", lines).dump_ast(), doc.dump_ast())
@@ -0,0 +1,108 @@
+import gc
+import time
+from unittest import TestCase
+
+from ast_parser import parse
+from core import BuildContext, Task
+from linker import link
+from transformer import transform
+
+# growing input 4x may grow time by 4x, or a bit more for n*log(n) and noise,
+# but not by anything close to quadratic 16x
+MAX_RATIO = 7
+
+
+def best_time(func, arg, repeat=5):
+    result = float("inf")
+    gc.disable()  # collections triggered by allocation only add noise
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func(arg)
+            result = min(result, time.perf_counter() - start)
+    finally:
+        gc.enable()
+    return result
+
+
+def text_lines(n):
+    return [f"Line {i} of a very long generated page." for i in range(n)]
+
+
+def header_lines(n):
+    lines = []
+    for i in range(n):
+        underline = "=" if i % 10 == 0 else "-"
+        lines.extend([f"Header {i}", underline * 20, f"Text of section {i}."])
+    return lines
+
+
+def role_lines(n):
+    return [" and ".join(f":doc:`page{i}`" for i in range(n))]
+
+
+def toctree_lines(n):
+    return ["Contents", "=" * 20, ".. toctree::"] + [f"   page{i}" for i in range(n)]
+
+
+class Noop(Task):
+    def __init__(self, follow_up):
+        self.follow_up = follow_up
+
+    def run(self):
+        if self.follow_up:
+            self.ctx.add_compile_task(Noop(False))
+
+
+class ComplexityTest(TestCase):
+    def assert_linear(self, func, make_input, n):
+        small, large = make_input(n), make_input(4 * n)
+        func(small)  # warm up
+        ratio = best_time(func, large) / best_time(func, small)
+        self.assertLess(ratio, MAX_RATIO)
+
+    def test_parse_long_document(self):
+        self.assert_linear(lambda x: parse("long", x), text_lines, 25000)
+
+    def test_parse_headers(self):
+        self.assert_linear(lambda x: parse("headers", x), header_lines, 10000)
+
+    def test_parse_roles(self):
+        def parse_roles(lines):
+            children = parse("roles", lines).children[0].children
+            links = [x for x in children if x.name == "a"]
+            self.assertEqual(lines[0].count(":doc:"), len(links))
+
+        self.assert_linear(parse_roles, role_lines, 25000)
+
+    def test_transform_headers(self):
+        def parse_and_transform(lines):
+            return transform(parse("headers", lines))
+
+        self.assert_linear(parse_and_transform, header_lines, 5000)
+
+    def test_transform_roles(self):
+        self.assert_linear(lambda x: transform(parse("roles", x)), role_lines, 10000)
+
+    def test_link_toctree(self):
+        ctx = BuildContext("/nonexistent")
+        for i in range(20000):
+            toctree = ["<ul>", f"<li>{i}</li>", "</ul>"]
+            ctx.cache.set_code("toctree", f"page{i}", toctree)
+
+        def transform_and_link(lines):
+            code = transform(parse("contents", lines))
+            code.write_cache(ctx.cache)
+            return list(link(ctx, "contents"))
+
+        self.assert_linear(transform_and_link, toctree_lines, 5000)
+
+    def test_execute_tasks(self):
+        def execute(n):
+            ctx = BuildContext("/nonexistent")
+            for _ in range(n):
+                ctx.add_compile_task(Noop(True))
+            ctx.execute_tasks(ctx.compile_tasks)
+            self.assertEqual(2 * n, len(ctx.executed_tasks))
+
+        self.assert_linear(execute, lambda n: n, 20000)
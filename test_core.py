@@ -1,13 +1,22 @@
-from unittest import TestCase
+import os
+import pickle
+import shutil
+import tempfile
+from unittest import TestCase, mock
 
+import transformer
 from core import CacheFile
-from utils import relative_of
 
 
 class CacheFileTest(TestCase):
+    def setUp(self):
+        # not the tracked cache/test.cache, which tests would keep rewriting
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        self.file_path = os.path.join(cache_dir, "test.cache")
+
     def test_load_save(self):
-        file_path = relative_of(__file__, "./cache/test.cache")
-        save_file = CacheFile(file_path)
+        save_file = CacheFile(self.file_path)
         save_file.purge()
 
         dependencies = set([("doc", "install")])
@@ -15,6 +24,41 @@ class CacheFileTest(TestCase):
         save_file.set_code("doc", "install", ["1", "2"])
         save_file.save()
 
-        load_file = CacheFile(file_path)
+        load_file = CacheFile(self.file_path)
         self.assertEqual(dependencies, load_file.get_dependencies("install"))
         self.assertEqual(["1", "2"], load_file.get_code("doc", "install"))
+
+    def test_frozen(self):
+        cache = CacheFile(self.file_path)
+        with cache.frozen():
+            with self.assertRaises(ValueError):
+                cache.set_code("doc", "install", [])
+        cache.set_code("doc", "install", [])
+
+    def test_version_bump(self):
+        save_file = CacheFile(self.file_path)
+        save_file.purge()
+        save_file.set_code("doc", "install", ["1", "2"])
+        save_file.save()
+        self.assertFalse(CacheFile(self.file_path).invalidated)
+
+        with mock.patch.object(transformer, "VERSION", transformer.VERSION + 1):
+            load_file = CacheFile(self.file_path)
+        self.assertTrue(load_file.invalidated)
+        self.assertEqual(set(), load_file.names())
+
+    def test_unversioned(self):
+        with open(self.file_path, "wb") as f:
+            pickle.dump({"dependencies": {}, "code": {}}, f)
+        self.assertTrue(CacheFile(self.file_path).invalidated)
+
+    def test_collect(self):
+        cache = CacheFile(self.file_path)
+        cache.purge()
+        for name in ("api", "old"):
+            cache.set_dependencies(name, {("doc", name)})
+            cache.set_code("doc", name, [])
+            cache.set_code("title", name, name)
+        self.assertEqual(3, cache.collect({"api"}))
+        self.assertEqual({"api"}, cache.names())
+        self.assertEqual({("doc", "api"), ("title", "api")}, set(cache.entry_sizes()))
@@ -1,5 +1,10 @@
-from unittest import TestCase
+import gzip
+import os
+import shutil
+import tempfile
+from unittest import TestCase, mock
 
+import linker
 from common import link_test_file, html_lines
 
 
@@ -88,3 +93,31 @@ class LinkerTest(TestCase):
                 ],
             ),
         )
+
+
+class WriteOutputTest(TestCase):
+    def setUp(self):
+        self.build_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.build_dir)
+        self.path = os.path.join(self.build_dir, "index.html")
+
+    def test_gzip(self):
+        linker.write_output(self.path, ["<html>", "</html>"], 9)
+        with gzip.open(self.path + ".gz") as f:
+            self.assertEqual(b"<html>\n</html>\n", f.read())
+
+    def test_gzip_reused(self):
+        linker.write_output(self.path, ["<html>", "</html>"], 9)
+        compress = mock.Mock(wraps=gzip.compress)
+        with mock.patch.object(linker.gzip, "compress", compress):
+            linker.write_output(self.path, ["<html>", "</html>"], 9, True)
+            compress.assert_not_called()
+
+            linker.write_output(self.path, ["<html>", "<p/>", "</html>"], 9, True)
+            compress.assert_called_once()
+
+    def test_gzip_not_reused(self):
+        linker.write_output(self.path, ["<html>", "</html>"], 1)
+        linker.write_output(self.path, ["<html>", "</html>"], 9)
+        with open(self.path + ".gz", "rb") as f:
+            self.assertEqual(gzip.compress(b"<html>\n</html>\n", 9, mtime=0), f.read())
@@ -0,0 +1,48 @@
+import contextlib
+import io
+import shutil
+import tempfile
+from unittest import TestCase, mock
+
+from memprofile import MemoryBudgetExceeded
+from test_project import make_project
+
+
+class MemProfileTest(TestCase):
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.base_dir)
+        self.proj = make_project(self.base_dir)
+
+    def run_quietly(self, *args):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            self.proj.run(*args)
+        return output.getvalue()
+
+    def test_phases(self):
+        report = self.run_quietly("build", "--memprofile")
+        names = [name for name, _, _ in self.proj.profiler.phases]
+        self.assertEqual(["scan", "compile", "write-cache", "link"], names)
+        self.assertTrue(all(peak > 0 for _, peak, _ in self.proj.profiler.phases))
+        self.assertEqual({}, self.proj.profiler.task_peaks)
+        self.assertIn("largest cache entries:", report)
+        self.assertIn("doc index:", report)
+
+    def test_tasks(self):
+        self.run_quietly("build", "--memprofile=tasks")
+        self.assertEqual(
+            {"scan", "parse", "transform", "writecache", "scanlinks", "link"},
+            set(self.proj.profiler.task_peaks),
+        )
+
+    def test_link_serially(self):
+        with mock.patch("project.execute_link_tasks") as execute_link_tasks:
+            self.run_quietly("build", "--memprofile=tasks", "--gzip", "--jobs=2")
+        execute_link_tasks.assert_not_called()
+        self.assertIn("link", self.proj.profiler.task_peaks)
+
+    def test_budget(self):
+        self.run_quietly("build", "--memory-budget=1024")
+        with self.assertRaises(MemoryBudgetExceeded):
+            self.run_quietly("rebuild", "--memory-budget=0")
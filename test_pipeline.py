@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import TestCase, mock
+
+import ast_parser
+import pipeline
+from test_project import make_project
+
+
+class PipelineTest(TestCase):
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.base_dir)
+
+    def build(self, name, *args):
+        proj = make_project(os.path.join(self.base_dir, name))
+        proj.run("build", *args)
+        outputs = {}
+        for filename in os.listdir(proj.ctx.build_dir):
+            with open(os.path.join(proj.ctx.build_dir, filename)) as f:
+                outputs[filename] = f.read()
+        return outputs
+
+    def test_same_output_as_serial(self):
+        serial = self.build("serial")
+        # link most pages in one pipeline run, not one by one as priority pages
+        with mock.patch("project.RECENT_PRIORITIES", 0):
+            self.assertEqual(serial, self.build("async", "--async", "--writers=2"))
+
+    def test_priority_pages_through_writers(self):
+        write_output = mock.Mock(wraps=pipeline.write_output)
+        with mock.patch.object(pipeline, "write_output", write_output):
+            self.build("async", "--async")
+        self.assertEqual(4, write_output.call_count)
+
+    def test_same_output_as_serial_subset(self):
+        self.assertEqual(
+            self.build("serial", "api"), self.build("async", "api", "--async")
+        )
+
+    def test_stream_same_output(self):
+        serial = self.build("serial")
+        self.assertEqual(serial, self.build("stream", "--stream"))
+        self.assertEqual(serial, self.build("async", "--stream", "--async"))
+
+    def test_write_error(self):
+        """failing writes neither hang the build nor end it silently"""
+
+        def failing_write(path, lines, gzip_level, reuse_gzip):
+            raise ValueError(path)
+
+        with mock.patch.object(pipeline, "write_output", failing_write):
+            with self.assertRaises(ValueError):
+                self.build("async", "--async", "--writers=2")
+
+    def test_reads_overlap(self):
+        """slow reads, like on a network filesystem, are issued concurrently"""
+        lock = threading.Lock()
+        active = [0, 0]  # current, max
+
+        def slow_read(path):
+            with lock:
+                active[0] += 1
+                active[1] = max(active)
+            time.sleep(0.05)
+            with lock:
+                active[0] -= 1
+            return ast_parser.read_source(path)
+
+        with mock.patch.object(pipeline, "read_source", slow_read):
+            self.build("async", "--async", "--prefetch=4")
+        self.assertGreater(active[1], 1)
@@ -0,0 +1,299 @@
+import contextlib
+import gzip
+import io
+import os
+import shutil
+import tempfile
+from unittest import TestCase, mock
+
+import transformer
+from ast_parser import source_digest
+from project import Project
+from utils import relative_of
+
+
+def make_project(base_dir) -> Project:
+    """copy sphinx example sources into `base_dir/src`"""
+    source_dir = relative_of(__file__, "./sphinx-example/source")
+    shutil.copytree(source_dir, os.path.join(base_dir, "src"))
+    return Project(base_dir)
+
+
+class ProjectTest(TestCase):
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.base_dir)
+        self.proj = make_project(self.base_dir)
+
+    def outputs(self):
+        return sorted(os.listdir(self.proj.ctx.build_dir))
+
+    def executed(self):
+        return [str(task) for task in self.proj.ctx.executed_tasks]
+
+    def test_build_all(self):
+        self.proj.run("build")
+        self.assertEqual(
+            ["api.html", "index.html", "install.html", "tutorial.html"],
+            self.outputs(),
+        )
+
+    def test_build_parallel_link(self):
+        self.proj.run("build")
+        serial = {}
+        for filename in self.outputs():
+            with open(os.path.join(self.proj.ctx.build_dir, filename)) as f:
+                serial[filename] = f.read()
+        shutil.rmtree(self.proj.ctx.build_dir)
+
+        proj = Project(self.base_dir)
+        proj.run("build", "--jobs=3")
+        for filename, content in serial.items():
+            with open(os.path.join(proj.ctx.build_dir, filename)) as f:
+                self.assertEqual(content, f.read())
+        linked = [x for x in proj.ctx.executed_tasks if str(x).startswith("link")]
+        self.assertEqual(4, len(linked))
+
+    def test_build_gzip_level_changed(self):
+        self.proj.run("build", "--gzip=1")
+        proj = Project(self.base_dir)
+        proj.run("build", "--gzip=9")
+        self.assertIn("link(index.rst)", [str(x) for x in proj.ctx.executed_tasks])
+        path = os.path.join(proj.ctx.build_dir, "index.html")
+        with open(path, "rb") as html, open(path + ".gz", "rb") as compressed:
+            self.assertEqual(gzip.compress(html.read(), 9, mtime=0), compressed.read())
+
+        proj = Project(self.base_dir)
+        proj.run("build", "--gzip=9")
+        executed = [str(x) for x in proj.ctx.executed_tasks]
+        self.assertFalse([x for x in executed if x.startswith("link")])
+
+    def test_build_gzip_invalid_level(self):
+        with self.assertRaises(AssertionError):
+            self.proj.run("build", "--gzip=12")
+
+    def test_build_subset(self):
+        self.proj.run("build", "api")
+        self.assertEqual(["api.html"], self.outputs())
+        parsed = [x for x in self.executed() if x.startswith("parse")]
+        self.assertEqual(["parse(api.rst)", "parse(tutorial.rst)"], parsed)
+
+        with open(os.path.join(self.proj.ctx.build_dir, "api.html")) as f:
+            self.assertIn("Beginners Tutorial\n", f.read())
+
+    def test_build_toctree_closure(self):
+        self.proj.run("build", "index")
+        self.assertEqual(["index.html"], self.outputs())
+        parsed = [x for x in self.executed() if x.startswith("parse")]
+        self.assertEqual(
+            [
+                "parse(index.rst)",
+                "parse(api.rst)",
+                "parse(install.rst)",
+                "parse(tutorial.rst)",
+            ],
+            parsed,
+        )
+
+    def test_build_unknown(self):
+        with self.assertRaises(AssertionError):
+            self.proj.run("build", "missing")
+
+    def test_gc(self):
+        self.proj.run("build")
+        os.unlink(os.path.join(self.proj.ctx.src_dir, "install.rst"))
+        with contextlib.redirect_stdout(io.StringIO()):
+            Project(self.base_dir).run("gc")
+        ctx = Project(self.base_dir).ctx
+        self.assertEqual({"api", "index", "tutorial"}, ctx.cache.names())
+        self.assertEqual({"api", "index", "tutorial"}, set(ctx.load_timings()))
+
+    def test_cache_stats(self):
+        self.proj.run("build")
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            Project(self.base_dir).run("cache-stats")
+        report = output.getvalue()
+        self.assertIn("4 documents", report)
+        self.assertIn("  toctree: 4 entries", report)
+        self.assertIn("Largest documents:", report)
+
+    def edit(self, file_name, text):
+        with open(os.path.join(self.proj.ctx.src_dir, file_name), "a") as f:
+            f.write(text)
+
+    def test_touched_source(self):
+        self.proj.run("build")
+        path = os.path.join(self.proj.ctx.src_dir, "api.rst")
+        os.utime(path, ns=(0, 0))
+        proj = Project(self.base_dir)
+        with mock.patch("ast_parser.source_digest", wraps=source_digest) as digest:
+            proj.run("build")
+        digest.assert_called_once_with(path)
+        self.assertNotIn("parse(api.rst)", [str(x) for x in proj.ctx.executed_tasks])
+
+    def test_resized_source_not_hashed_on_scan(self):
+        self.proj.run("build")
+        self.edit("api.rst", "\nMore text.\n")
+        proj = Project(self.base_dir)
+        with mock.patch("ast_parser.source_digest") as digest:
+            proj.run("build")
+        digest.assert_not_called()
+        self.assertIn("parse(api.rst)", [str(x) for x in proj.ctx.executed_tasks])
+
+    def test_rewritten_source_hashed_once(self):
+        self.proj.run("build")
+        path = os.path.join(self.proj.ctx.src_dir, "api.rst")
+        with open(path, "rb") as f:
+            source = f.read()
+        with open(path, "wb") as f:
+            f.write(source.replace(b"API", b"Api", 1))
+        os.utime(path, ns=(0, 0))
+        proj = Project(self.base_dir)
+        with mock.patch("ast_parser.source_digest", wraps=source_digest) as digest:
+            proj.run("build")
+        digest.assert_called_once_with(path)
+        parse = [x for x in proj.ctx.executed_tasks if str(x) == "parse(api.rst)"]
+        self.assertEqual(source_digest(path), parse[0].digest)  # passed on, not hashed
+        self.assertEqual(source_digest(path), proj.ctx.cache.get_source("api")[2])
+
+    def test_incremental_build(self):
+        self.proj.run("build")
+        proj = Project(self.base_dir)
+        proj.run("build")
+        executed = [str(x) for x in proj.ctx.executed_tasks]
+        self.assertEqual({"scan", "scan_links"}, set(executed))
+
+        self.edit("tutorial.rst", "\nMore text.\n")
+        proj = Project(self.base_dir)
+        proj.run("build")
+        executed = [str(x) for x in proj.ctx.executed_tasks]
+        self.assertIn("parse(tutorial.rst)", executed)
+        self.assertNotIn("parse(api.rst)", executed)
+        self.assertIn("link(tutorial.rst)", executed)
+        self.assertNotIn("link(api.rst)", executed)  # title unchanged
+
+    def test_targeted_then_full_build(self):
+        self.proj.run("build")
+        with open(os.path.join(self.proj.ctx.src_dir, "tutorial.rst")) as f:
+            source = f.read()
+        with open(os.path.join(self.proj.ctx.src_dir, "tutorial.rst"), "w") as f:
+            f.write(source.replace("Beginners Tutorial", "First Steps"))
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            Project(self.base_dir).run("build", "tutorial")
+            proj = Project(self.base_dir)
+            proj.run("plan")
+            proj.run("build")
+        executed = [str(x) for x in proj.ctx.executed_tasks]
+        self.assertEqual([], [x for x in executed if x.startswith("parse")])
+        self.assertIn("link(api.rst)", executed)
+        self.assertIn("link(index.rst)", executed)
+        self.assertNotIn("link(tutorial.rst)", executed)
+        with open(os.path.join(proj.ctx.build_dir, "api.html")) as f:
+            self.assertIn("First Steps\n", f.read())
+
+    def test_plan_after_targeted_build(self):
+        self.proj.run("build")
+        self.edit("tutorial.rst", "\nNew Section\n-----------\n")
+        with contextlib.redirect_stdout(io.StringIO()):
+            Project(self.base_dir).run("build", "tutorial")
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            Project(self.base_dir).run("plan")
+        lines = output.getvalue().splitlines()
+        self.assertTrue(
+            lines[1].startswith("index: link: ('toctree', 'tutorial') changed"),
+            lines[1],
+        )
+
+    def test_plan(self):
+        self.proj.run("build")
+        self.edit("tutorial.rst", "\nNew Section\n-----------\n")
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            Project(self.base_dir).run("plan")
+        lines = output.getvalue().splitlines()
+        expected = [
+            "api: link: dependency ('title', 'tutorial') changed ~0.",
+            "index: link: dependency ('toctree', 'tutorial') changed ~0.",
+            "install: skip",
+            "tutorial: compile: source changed; link: source changed ~0.",
+            "Estimated cost: 0.",
+        ]
+        self.assertEqual(len(expected), len(lines))
+        for prefix, line in zip(expected, lines):
+            self.assertTrue(line.startswith(prefix), line)
+
+    def test_plan_fresh(self):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            self.proj.run("plan", "api")
+        self.assertEqual(
+            [
+                "api: compile: cache missing; link: cache missing ~?",
+                "Estimated cost: 0.000s, 1 documents without timings",
+            ],
+            output.getvalue().splitlines(),
+        )
+
+    def test_build_gzip(self):
+        self.proj.run("build")
+        proj = Project(self.base_dir)
+        proj.run("build", "--gzip=9", "--jobs=2")
+        self.assertEqual(
+            [
+                "api.html",
+                "api.html.gz",
+                "index.html",
+                "index.html.gz",
+                "install.html",
+                "install.html.gz",
+                "tutorial.html",
+                "tutorial.html.gz",
+            ],
+            self.outputs(),
+        )
+
+    def test_build_sections(self):
+        self.proj.ctx.section_lines = 0
+        self.proj.run("build")
+        with open(os.path.join(self.proj.ctx.build_dir, "tutorial.html")) as f:
+            whole = f.read().replace("Logging", "Tracing").replace("logging", "tracing")
+
+        with open(os.path.join(self.proj.ctx.src_dir, "tutorial.rst")) as f:
+            source = f.read()
+        with open(os.path.join(self.proj.ctx.src_dir, "tutorial.rst"), "w") as f:
+            f.write(source.replace("Adding Logging", "Adding Tracing"))
+
+        proj = Project(self.base_dir)
+        proj.ctx.section_lines = 0
+        spy = mock.Mock(wraps=transformer.transform_section)
+        with mock.patch.object(transformer, "transform_section", spy):
+            proj.run("build")
+        self.assertEqual(1, spy.call_count)  # only the edited section
+        with open(os.path.join(proj.ctx.build_dir, "tutorial.html")) as f:
+            self.assertEqual(whole, f.read())
+
+    def test_build_first(self):
+        self.proj.run("build", "--first=api")
+        executed = [str(x) for x in self.proj.ctx.executed_tasks]
+        first_page = executed.index("link(api.rst)")
+        parsed = [x for x in executed[:first_page] if x.startswith("parse")]
+        self.assertEqual(["parse(api.rst)", "parse(tutorial.rst)"], parsed)
+        self.assertEqual(1, executed.count("link(api.rst)"))
+        self.assertEqual(4, len(self.outputs()))
+        self.assertIsNotNone(self.proj.time_to_first_page)
+
+    def test_build_index_first(self):
+        self.proj.run("build")
+        executed = [str(x) for x in self.proj.ctx.executed_tasks]
+        links = [x for x in executed if x.startswith("link")]
+        self.assertEqual("link(index.rst)", links[0])
+        self.assertEqual(4, len(links))
+
+    def test_build_first_evicts_once(self):
+        store_dir = os.path.join(self.base_dir, "shared")
+        with mock.patch("store.SharedCache.evict") as evict:
+            self.proj.run("build", "--first=api", f"--shared-cache={store_dir}")
+        evict.assert_called_once()
@@ -0,0 +1,80 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from core import CacheFile
+from project import Project
+from test_project import make_project
+
+
+def compile_shard(base_dir, shard):
+    Project(base_dir).run("compile", f"--shard={shard}")
+
+
+class ShardTest(TestCase):
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.base_dir)
+
+    def outputs(self, proj):
+        outputs = {}
+        for filename in os.listdir(proj.ctx.build_dir):
+            with open(os.path.join(proj.ctx.build_dir, filename)) as f:
+                outputs[filename] = f.read()
+        return outputs
+
+    def test_compile_shards_and_merge(self):
+        full = make_project(os.path.join(self.base_dir, "full"))
+        full.run("build")
+
+        merged = make_project(os.path.join(self.base_dir, "merged"))
+        shards = []
+        for index in range(3):
+            node_dir = os.path.join(self.base_dir, f"node{index}")
+            make_project(node_dir)
+            process = multiprocessing.Process(
+                target=compile_shard, args=(node_dir, f"{index}/3")
+            )
+            process.start()
+            shards.append((process, Project(node_dir).ctx.shard_path(index, 3)))
+        for process, _ in shards:
+            process.join()
+            self.assertEqual(0, process.exitcode)
+
+        names = [CacheFile(path).names() for _, path in shards]
+        self.assertEqual(4, sum(len(x) for x in names))
+        self.assertEqual({"api", "index", "install", "tutorial"}, set.union(*names))
+
+        merged.run("merge", *[path for _, path in shards])
+        self.assertEqual(self.outputs(full), self.outputs(merged))
+
+    def test_merge_missing_shard(self):
+        proj = make_project(self.base_dir)
+        proj.run("compile", "--shard=0/2")
+        with self.assertRaises(AssertionError):
+            Project(self.base_dir).run("merge")
+
+    def test_merge_latest_shards(self):
+        proj = make_project(self.base_dir)
+        proj.run("compile", "--shard=1/3")
+        stale = proj.ctx.shard_path(1, 3)
+        os.utime(stale, (0, 0))
+        for index in range(2):
+            Project(self.base_dir).run("compile", f"--shard={index}/2")
+        proj = Project(self.base_dir)
+        self.assertEqual(
+            [proj.ctx.shard_path(0, 2), proj.ctx.shard_path(1, 2)],
+            proj.latest_shards(),
+        )
+        proj.run("merge")
+        self.assertEqual(4, len(os.listdir(proj.ctx.build_dir)))
+
+    def test_merge_conflict(self):
+        first = CacheFile(os.path.join(self.base_dir, "first.cache"))
+        first.set_code("title", "api", "API Reference")
+        second = CacheFile(os.path.join(self.base_dir, "second.cache"))
+        second.set_code("title", "api", "API")
+        with self.assertRaises(ValueError):
+            first.merge(second)
@@ -0,0 +1,97 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase, mock
+
+from core import Code
+from store import SharedCache
+from test_project import make_project
+
+
+class SharedCacheTest(TestCase):
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.base_dir)
+        self.store_dir = os.path.join(self.base_dir, "store")
+
+    def build(self, name, *args):
+        proj = make_project(os.path.join(self.base_dir, name))
+        proj.run("build", f"--shared-cache={self.store_dir}", *args)
+        return proj
+
+    def transformed(self, proj):
+        tasks = [str(x) for x in proj.ctx.executed_tasks]
+        return [x for x in tasks if x.startswith("transform")]
+
+    def test_reuse_across_checkouts(self):
+        first = self.build("first")
+        self.assertEqual(4, len(self.transformed(first)))
+
+        second = self.build("second")
+        self.assertEqual([], self.transformed(second))
+        with open(os.path.join(first.ctx.build_dir, "index.html")) as f1:
+            with open(os.path.join(second.ctx.build_dir, "index.html")) as f2:
+                self.assertEqual(f1.read(), f2.read())
+
+    def test_changed_source(self):
+        self.build("first")
+        proj = make_project(os.path.join(self.base_dir, "second"))
+        with open(os.path.join(proj.ctx.src_dir, "install.rst"), "a") as f:
+            f.write("\nSee :doc:`api`.\n")
+        proj.run("build", f"--shared-cache={self.store_dir}")
+        self.assertEqual(["transform(install)"], self.transformed(proj))
+
+    def test_key(self):
+        store = SharedCache(self.store_dir)
+        self.assertEqual(store.key("api", b"x"), store.key("api", b"x"))
+        self.assertNotEqual(store.key("api", b"x"), store.key("api", b"y"))
+        self.assertNotEqual(store.key("api", b"x"), store.key("index", b"x"))
+
+    def test_corrupt_entry_is_miss(self):
+        store = SharedCache(self.store_dir)
+        key = store.key("api", b"x")
+        os.makedirs(os.path.dirname(store.path(key)))
+        with open(store.path(key), "wb") as f:
+            f.write(b"\x80")
+        self.assertIsNone(store.get(key))
+
+    def test_evict_least_recently_used(self):
+        store = SharedCache(self.store_dir)
+        keys = [store.key(str(i), b"") for i in range(3)]
+        for i, key in enumerate(keys):
+            store.put(key, Code(str(i)))
+            os.utime(store.path(key), (i, i))
+        store.get(keys[0])  # now most recently used
+
+        store.max_bytes = os.path.getsize(store.path(keys[0])) * 2
+        store.evict()
+        self.assertIsNotNone(store.get(keys[0]))
+        self.assertIsNone(store.get(keys[1]))
+        self.assertIsNotNone(store.get(keys[2]))
+
+    def test_evict_skips_temp_files(self):
+        store = SharedCache(self.store_dir, max_bytes=0)
+        os.makedirs(os.path.join(self.store_dir, "ab"))
+        writing = os.path.join(self.store_dir, "ab", "writing.tmp")
+        stale = os.path.join(self.store_dir, "ab", "stale.tmp")
+        for path in (writing, stale):
+            with open(path, "wb") as f:
+                f.write(b"x")
+        os.utime(stale, (0, 0))
+        store.evict()
+        self.assertTrue(os.path.exists(writing))
+        self.assertFalse(os.path.exists(stale))
+
+    def test_put_temp_file_gone(self):
+        store = SharedCache(self.store_dir)
+
+        error = FileNotFoundError("replace")
+
+        def replace(src, dst):
+            os.unlink(src)  # as if evicted by another build
+            raise error
+
+        with mock.patch("os.replace", replace):
+            with self.assertRaises(FileNotFoundError) as raised:
+                store.put(store.key("api", b"x"), Code("api"))
+        self.assertIs(error, raised.exception)  # not one of cleaning up
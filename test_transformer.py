@@ -1,8 +1,18 @@
 from unittest import TestCase
 
-from test_ast_parser import parse_ast
+from test_ast_parser import parse_ast, source_path
 
-from transformer import transform
+from ast_parser import iter_source_lines, parse, parse_sections, parse_stream
+from core import AstNode, Code
+from transformer import (
+    HANDLERS,
+    CodeVisitor,
+    assemble_sections,
+    register,
+    transform,
+    transform_section,
+    transform_stream,
+)
 
 
 class TransformerTest(TestCase):
@@ -145,3 +155,49 @@ class TransformerTest(TestCase):
             ),
             code.dependencies,
         )
+
+    def test_unknown_node(self):
+        with self.assertRaises(ValueError):
+            CodeVisitor(Code("x")).visit(AstNode("unknown"))
+
+    def test_register_directive(self):
+        def enter_note(code, node):
+            code.add_html('<div class="note">')
+            return True
+
+        def leave_note(code, node):
+            code.add_html("</div>")
+
+        handlers = dict(HANDLERS)
+        register("note", enter_note, leave_note, handlers)
+        note = AstNode("note")
+        note.append_child(AstNode("text", "Careful"))
+        code = Code("x")
+        CodeVisitor(code, handlers).visit(note)
+        self.assertEqual(['<div class="note">', "Careful", "</div>"], code.html)
+        self.assertNotIn("note", HANDLERS)
+
+    def test_transform_sections(self):
+        lines = ["Guide", "=====", ".. toctree::", "   install", "See :doc:`api`."]
+        for i in range(3):
+            lines.extend([f"Part {i}", "-----", f"Text {i}", ".. toctree::", "   api"])
+
+        whole = transform(parse("guide", lines))
+        sections = [
+            transform_section(nodes) for _, nodes in parse_sections(lines)
+        ]
+        code = assemble_sections("guide", sections)
+        self.assertEqual(whole.title, code.title)
+        self.assertEqual(whole.toctree, code.toctree)
+        self.assertEqual(whole.html, code.html)
+        self.assertEqual(whole.dependencies, code.dependencies)
+
+    def test_transform_stream(self):
+        for file_name in ("api.rst", "index.rst", "install.rst", "tutorial.rst"):
+            whole = transform(parse_ast(file_name))
+            nodes = parse_stream(iter_source_lines(source_path(file_name)))
+            code = transform_stream(whole.name, nodes)
+            self.assertEqual(whole.title, code.title)
+            self.assertEqual(whole.toctree, code.toctree)
+            self.assertEqual(whole.html, code.html)
+            self.assertEqual(whole.dependencies, code.dependencies)
@@ -1,5 +1,10 @@
+import sys
+
 from core import AstDoc, AstNode, Code
 
+# bump when transformed code changes for a same ast, invalidates compiled code
+VERSION = 1
+
 
 def transform(doc: AstDoc) -> Code:
     code = Code(doc.name)
@@ -10,6 +15,47 @@ def transform(doc: AstDoc) -> Code:
     return code
 
 
+def transform_section(nodes):
+    """top level nodes of a section -> (headers, html, dependencies)"""
+    code = Code(None)
+    visitor = CodeVisitor(code)
+    for node in nodes:
+        visitor.visit(node)
+    headers = [node for node in nodes if node.header_level() > 0]
+    return headers, code.html, code.dependencies
+
+
+def assemble_sections(name, sections) -> Code:
+    """join transformed sections into code of the whole document"""
+    doc = AstDoc(name)  # headers only, enough for title and toctree
+    for headers, _, _ in sections:
+        for header in headers:
+            doc.append_child(header)
+
+    code = Code(name)
+    code.title = doc.title()
+    transform_toctree(doc, code)
+    enter, leave = HANDLERS["doc"]
+    enter(code, doc)
+    for _, html, dependencies in sections:
+        code.add_html(*html)
+        code.dependencies.update(dependencies)
+    leave(code, doc)
+    return code
+
+
+def transform_stream(name, nodes) -> Code:
+    """transform top level nodes as they come, keeping only headers of them"""
+    body = Code(name)
+    visitor = CodeVisitor(body)
+    headers = []
+    for node in nodes:
+        visitor.visit(node)
+        if node.header_level() > 0:
+            headers.append(node)
+    return assemble_sections(name, [(headers, body.html, body.dependencies)])
+
+
 def transform_toctree(doc: AstDoc, code: Code):
     """convert toctree to nested <ul> tag"""
     headers = doc.headers()
@@ -44,59 +90,110 @@ def transform_toctree(doc: AstDoc, code: Code):
     code.add_toctree("</ul>")
 
 
+# node kind -> (enter, leave) handlers, see `register`
+HANDLERS = {}
+
+
+def register(kind, enter, leave=None, handlers=HANDLERS):
+    """Register how nodes of a kind are transformed, e.g. for new directives
+
+    `enter(code, node)` is called when the node is reached; if it returns
+    true, children of the node are visited and then `leave(code, node)` is
+    called.
+    """
+    handlers[sys.intern(kind)] = (enter, leave)
+
+
 class CodeVisitor:
-    def __init__(self, code):
+    def __init__(self, code, handlers=None):
         self.code = code
+        self.handlers = HANDLERS if handlers is None else handlers
 
     def visit(self, node: AstNode):
-        getattr(self, node.name)(node)
-
-    def visit_children(self, node: AstNode):
-        for child in node.children or []:
-            self.visit(child)
-
-    def doc(self, node: AstNode):
-        self.code.add_html(
-            "<html>", "<head>", f"<title>{node.title()}</title>", "</head>", "<body>"
-        )
-        self.visit_children(node)
-        self.code.add_html("</body>", "</html>")
-        self.code.add_dependency("doc", node.data)
-
-    def h1(self, node: AstNode):
-        self.code.add_html(f"<h1>{node.data}</h1>")
-
-    def h2(self, node: AstNode):
-        self.code.add_html(f'<a name="{node.slug()}"/>', f"<h2>{node.data}</h2>")
-
-    def p(self, node: AstNode):
-        if (
-            node.children
-            and len(node.children) == 1
-            and node.children[0].name == "text"
-        ):
-            p = f"<p>{node.children[0].data}</p>"
-            self.code.add_html(p)
-        else:
-            self.code.add_html("<p>")
-            self.visit_children(node)
-            self.code.add_html("</p>")
-
-    def text(self, node: AstNode):
-        self.code.add_html(node.data)
-
-    def a(self, node: AstNode):
-        target = f"{node.data}.html"
-        self.code.add_html(
-            f'<a href="{target}>', f'{{{{ ctx.get_title("{node.data}") }}}}', "</a>"
-        )
-        self.code.add_dependency("title", node.data)
-
-    def toctree(self, node: AstNode):
-        self.code.add_html("<ul>")
-        self.visit_children(node)
-        self.code.add_html("</ul>")
-
-    def toc(self, node: AstNode):
-        self.code.add_html(f"{{{{ ctx.get_toctree('{node.data}') }}}}")
-        self.code.add_dependency("toctree", node.data)
+        """visit node and its descendants in document order"""
+        code = self.code
+        handlers = self.handlers
+        stack = [(None, node)]  # (leave handler to call, or None to enter)
+        while stack:
+            leave, node = stack.pop()
+            if leave is not None:
+                leave(code, node)
+                continue
+
+            handler = handlers.get(node.name)
+            if handler is None:
+                raise ValueError(f"No transform handler for node: {node.name}")
+            enter, leave = handler
+            if enter(code, node):
+                if leave is not None:
+                    stack.append((leave, node))
+                if node.children:
+                    stack.extend((None, child) for child in reversed(node.children))
+
+
+def enter_doc(code: Code, node: AstDoc):
+    code.add_html(
+        "<html>", "<head>", f"<title>{node.title()}</title>", "</head>", "<body>"
+    )
+    return True
+
+
+def leave_doc(code: Code, node: AstDoc):
+    code.add_html("</body>", "</html>")
+    code.add_dependency("doc", node.data)
+
+
+def enter_h1(code: Code, node: AstNode):
+    code.add_html(f"<h1>{node.data}</h1>")
+
+
+def enter_h2(code: Code, node: AstNode):
+    code.add_html(f'<a name="{node.slug()}"/>', f"<h2>{node.data}</h2>")
+
+
+def enter_p(code: Code, node: AstNode):
+    if node.children and len(node.children) == 1 and node.children[0].name == "text":
+        code.add_html(f"<p>{node.children[0].data}</p>")
+        return False
+    code.add_html("<p>")
+    return True
+
+
+def leave_p(code: Code, node: AstNode):
+    code.add_html("</p>")
+
+
+def enter_text(code: Code, node: AstNode):
+    code.add_html(node.data)
+
+
+def enter_a(code: Code, node: AstNode):
+    target = f"{node.data}.html"
+    code.add_html(
+        f'<a href="{target}>', f'{{{{ ctx.get_title("{node.data}") }}}}', "</a>"
+    )
+    code.add_dependency("title", node.data)
+
+
+def enter_toctree(code: Code, node: AstNode):
+    code.add_html("<ul>")
+    return True
+
+
+def leave_toctree(code: Code, node: AstNode):
+    code.add_html("</ul>")
+
+
+def enter_toc(code: Code, node: AstNode):
+    code.add_html(f"{{{{ ctx.get_toctree('{node.data}') }}}}")
+    code.add_dependency("toctree", node.data)
+
+
+register("doc", enter_doc, leave_doc)
+register("h1", enter_h1)
+register("h2", enter_h2)
+register("p", enter_p, leave_p)
+register("text", enter_text)
+register("a", enter_a)
+register("toctree", enter_toctree, leave_toctree)
+register("toc", enter_toc)
@@ -19,3 +19,17 @@ def get_name_prefix(file_name: str) -> str:
 def relative_of(base_path: str, relative_path: str) -> str:
     """Given a base file and path relative to it, get full path of it"""
     return os.path.normpath(os.path.join(os.path.dirname(base_path), relative_path))
+
+
+def parse_option(arg: str):
+    """`--name=value` -> (name, value), `--name` -> (name, True)"""
+    name, sep, value = arg[2:].partition("=")
+    return name, value if sep else True
+
+
+def parse_shard(value: str):
+    """`i/N` -> (i, N)"""
+    index, _, count = value.partition("/")
+    index, count = int(index), int(count)
+    assert 0 <= index < count, f"Invalid shard: {value}"
+    return index, count